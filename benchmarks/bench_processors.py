@@ -0,0 +1,217 @@
+"""Wall time and peak memory benchmarks for the DSTrace notebook processors
+and for the full processors chain (in memory and through a temp file).
+
+Usage (from the repository root, with dstrace installed via `pip install -e .`):
+
+    python -m benchmarks.bench_processors                      # compare against stored baselines
+    python -m benchmarks.bench_processors --save_baseline      # store the current results as baselines
+    python -m benchmarks.bench_processors --large              # also run the hundreds of MB scenarios
+    python -m benchmarks.bench_processors --scenario tag_dense --repeat 10
+    python -m benchmarks.bench_processors --check_time         # also compare wall time (see below)
+
+Peak memory barely depends on the machine, so its baselines are stored in benchmarks/baselines.json
+and checked by default. Wall time is only comparable on the machine the baselines were saved on,
+so it is stored and checked with --check_time only (e.g. `--save_baseline --check_time` on a CI runner
+followed by `--check_time` runs there). The run exits with a non-zero code on regressions
+and when there are no baselines to compare against (unless --save_baseline is given).
+"""
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import fire
+import git
+
+from dstrace.dstrace import (
+    get_dstrace_tags,
+    handle_commit_url,
+    handle_input,
+    handle_output,
+    preprocess,
+    remove_dstrace_tokens,
+    with_preprocessed_temp_file,
+)
+from .synthetic import make_notebook
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_THRESHOLD = 0.25  # allowed relative slowdown / memory growth before a result counts as a regression
+MEMORY_METRICS = ('peak_bytes',)
+TIME_METRICS = ('seconds',)
+# absolute slack on top of the threshold so that sub-millisecond and near-zero allocation results do not flap
+TOLERANCE = {
+    'seconds': 0.001,
+    'peak_bytes': 64 * 2 ** 10,
+}
+
+SCENARIOS = {
+    'small': dict(cells=50, output_size=1_000),
+    'many_cells': dict(cells=5_000, output_size=200),
+    'magic_heavy': dict(cells=1_000, magic_ratio=0.9, output_size=200),
+    'tag_dense': dict(cells=1_000, tag_density=1.0, output_size=200),
+    'large_outputs': dict(cells=100, output_size=200_000),  # ~20MB
+}
+LARGE_SCENARIOS = {
+    'huge_outputs': dict(cells=300, output_size=1_000_000, markdown_ratio=0),  # ~300MB
+}
+
+CONFIG = {'code': False}
+PROCESSORS = [
+    handle_input,
+    handle_output,
+    handle_commit_url,
+    remove_dstrace_tokens,
+]
+
+
+@contextlib.contextmanager
+def temp_git_repo():
+    """Runs the benchmarks inside of a throwaway GIT repository with a remote,
+    as handle_commit_url resolves the last commit URL of the current directory.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as path:
+        repo = git.Repo.init(path)
+        repo.create_remote('origin', 'git@github.com:sancau/dstrace-benchmark.git')
+        actor = git.Actor('DSTrace', 'dstrace@example.com')
+        repo.index.commit('DSTrace benchmark', author=actor, committer=actor)
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(cwd)
+
+
+def measure(func, *, repeat: int) -> dict:
+    """Returns the best wall time of <repeat> calls of <func> and the peak memory allocated by a single call.
+
+    Memory is traced in a separate call as tracemalloc slows the execution down.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': min(timings), 'peak_bytes': peak}
+
+
+def get_benchmarks(raw_data: str, path: str) -> dict:
+    """Returns benchmark name to callable mapping for the notebook given as <raw_data> and stored at <path>.
+    """
+    nb = json.loads(raw_data)
+    sources = [cell['source'] for cell in nb['cells'] if cell['cell_type'] == 'code']
+    del nb
+
+    def tags():
+        for source in sources:
+            get_dstrace_tags(source)
+
+    def chain():
+        with_preprocessed_temp_file(PROCESSORS, config=CONFIG)(lambda temp_file_path: None)(path)
+
+    benchmarks = {'get_dstrace_tags': tags}
+    for processor in PROCESSORS:
+        benchmarks[processor.__name__] = (lambda p: lambda: p(raw_data, config=CONFIG))(processor)
+    benchmarks['preprocess'] = lambda: preprocess(raw_data, PROCESSORS, config=CONFIG)
+    benchmarks['with_preprocessed_temp_file'] = chain
+    return benchmarks
+
+
+def run_scenario(name: str, params: dict, *, repeat: int) -> dict:
+    raw_data = make_notebook(**params)
+    path = f'{name}.ipynb'
+    with open(path, 'w') as f:
+        f.write(raw_data)
+    try:
+        results = {}
+        for bench_name, func in get_benchmarks(raw_data, path).items():
+            results[f'{name}.{bench_name}'] = measure(func, repeat=repeat)
+            write_result(f'{name}.{bench_name}', results[f'{name}.{bench_name}'])
+        return results
+    finally:
+        os.remove(path)
+
+
+def write_result(key: str, result: dict, note: str = ''):
+    # stored baselines may hold peak memory only
+    seconds = f'{result["seconds"] * 1000:>12.2f} ms' if 'seconds' in result else f'{"-":>15}'
+    peak = f'{result["peak_bytes"] / 2 ** 20:>12.2f} MB' if 'peak_bytes' in result else f'{"-":>15}'
+    sys.stdout.write(f'{key:<50} {seconds} {peak}{note}\n')
+
+
+def write_missing(key: str, metrics):
+    sys.stdout.write(f'{key:<50} no {"/".join(metrics)} baseline\n')
+
+
+def find_regressions(results: dict, baselines: dict, *, threshold: float, metrics) -> dict:
+    """Returns results exceeding the corresponding baselines by more than <threshold> (relative) in any of <metrics>.
+    """
+    regressions = {}
+    for key, result in results.items():
+        baseline = baselines.get(key, {})
+        missing = [metric for metric in metrics if metric not in baseline]
+        if missing:
+            write_missing(key, missing)
+        if any(
+            result[metric] > baseline[metric] * (1 + threshold) + TOLERANCE[metric]
+            for metric in metrics if metric in baseline
+        ):
+            regressions[key] = result
+    return regressions
+
+
+def run(scenario: str = None, repeat: int = 3, large: bool = False, save_baseline: bool = False,
+        check_time: bool = False, threshold: float = DEFAULT_THRESHOLD, baseline_path: str = BASELINE_PATH):
+    metrics = MEMORY_METRICS + TIME_METRICS if check_time else MEMORY_METRICS
+    scenarios = dict(SCENARIOS, **LARGE_SCENARIOS) if large else dict(SCENARIOS)
+    if scenario is not None:
+        scenarios = {scenario: dict(SCENARIOS, **LARGE_SCENARIOS)[scenario]}
+
+    sys.stdout.write(f'\n{"benchmark":<50} {"wall time":>15} {"peak memory":>15}\n{"=" * 82}\n')
+    results = {}
+    with temp_git_repo():
+        for name, params in scenarios.items():
+            results.update(run_scenario(name, params, repeat=repeat))
+
+    baselines = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baselines = json.load(f)
+
+    if save_baseline:
+        for key, result in results.items():
+            baselines.setdefault(key, {}).update({metric: result[metric] for metric in metrics})
+        with open(baseline_path, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        sys.stdout.write(f'\nBaselines saved to {baseline_path}\n')
+        return
+
+    if not baselines:
+        sys.stdout.write(f'\nNo baselines found at {baseline_path}. Rerun with --save_baseline to store them.\n')
+        sys.exit(1)
+
+    sys.stdout.write('\n')
+    regressions = find_regressions(results, baselines, threshold=threshold, metrics=metrics)
+    if regressions:
+        sys.stdout.write(f'\nRegressions of {"/".join(metrics)} (more than {threshold:.0%} over the baseline):\n\n')
+        for key, result in regressions.items():
+            write_result(key, result)
+            write_result(key, baselines[key], ' (baseline)')
+        sys.exit(1)
+    sys.stdout.write(f'\nNo {"/".join(metrics)} regressions (threshold {threshold:.0%}).\n')
+
+
+if __name__ == '__main__':
+    fire.Fire(run)
@@ -0,0 +1,85 @@
+"""Synthetic Jupyter notebooks for the DSTrace processors benchmarks.
+"""
+import json
+import random
+
+from dstrace.dstrace import DSTRACE_CELL_TAGS
+
+
+MAGIC_LINES = ['%matplotlib inline\n', '%load_ext autoreload\n', '%autoreload 2\n', '\n']
+# a printable chunk that looks like base64 encoded image data
+OUTPUT_CHUNK = 'iVBORw0KGgoAAAANSUhEUgAAA+gAAAPoCAYAAAB6n0w5AAAABHNCSVQICAgIfAhkiAAAAAlwSFlz'
+
+
+def make_output(size: int) -> dict:
+    """Returns a display_data output carrying roughly <size> bytes of image data.
+    """
+    repeats, rest = divmod(size, len(OUTPUT_CHUNK))
+    rest -= rest % 4  # keep the data decodable as base64
+    return {
+        'output_type': 'display_data',
+        'metadata': {},
+        'data': {
+            'image/png': OUTPUT_CHUNK * repeats + OUTPUT_CHUNK[:rest],
+            'text/plain': ['<Figure size 432x288 with 1 Axes>'],
+        },
+    }
+
+
+def make_code_cell(rnd: random.Random, *, magic_ratio: float, tag_density: float, output_size: int) -> dict:
+    source = []
+    if rnd.random() < magic_ratio:
+        source.extend(rnd.sample(MAGIC_LINES, rnd.randint(1, len(MAGIC_LINES))))
+    if rnd.random() < tag_density:
+        tags = rnd.sample(DSTRACE_CELL_TAGS, rnd.randint(1, len(DSTRACE_CELL_TAGS)))
+        source.append(f'# {" ".join(tags)}\n')
+    source.extend([
+        'df = load_dataset()\n',
+        'df.groupby("user_id").agg({"value": "mean"}).plot()\n',
+    ])
+    return {
+        'cell_type': 'code',
+        'execution_count': 1,
+        'metadata': {},
+        'outputs': [make_output(output_size)] if output_size else [],
+        'source': source,
+    }
+
+
+def make_markdown_cell() -> dict:
+    return {
+        'cell_type': 'markdown',
+        'metadata': {},
+        'source': ['## Results\n', '\n', 'Average value per user.'],
+    }
+
+
+def make_notebook(*, cells: int, magic_ratio: float = 0.2, tag_density: float = 0.3,
+                  output_size: int = 1024, markdown_ratio: float = 0.2, seed: int = 0) -> str:
+    """Returns a JSON-formatted notebook with <cells> cells.
+
+    <magic_ratio> and <tag_density> are the shares of code cells starting with IPython magic lines
+    and carrying a DSTrace tags comment, <output_size> is the size (in bytes) of each code cell output.
+    The result is deterministic for the given <seed>.
+    """
+    rnd = random.Random(seed)
+    nb_cells = []
+    for _ in range(cells):
+        if rnd.random() < markdown_ratio:
+            nb_cells.append(make_markdown_cell())
+        else:
+            nb_cells.append(make_code_cell(
+                rnd,
+                magic_ratio=magic_ratio,
+                tag_density=tag_density,
+                output_size=output_size,
+            ))
+    nb = {
+        'cells': nb_cells,
+        'metadata': {
+            'kernelspec': {'display_name': 'Python 3', 'language': 'python', 'name': 'python3'},
+        },
+        'nbformat': 4,
+        'nbformat_minor': 4,
+    }
+    return json.dumps(nb)
@@ -1,4 +1,5 @@
 import glob
+import hashlib
 import json
 import os
 import uuid
@@ -25,6 +26,7 @@ DSTRACE_DEFAULT_LOCAL_CONFIG = {
 }
 DSTRACE_CONFIG_PATH = '.dstrace'
 DSTRACE_LOCAL_CONFIG_PATH = '.dstracelocal'
+DSTRACE_JOURNAL_NAME = 'dstrace-journal'  # kept in the git directory
 DSTRACE_CONFLUENCE_FORCE_INCLUDE_INPUT_TAG = 'dstrace_confluence_force_include_input'
 DSTRACE_INCLUDE_INPUT_TOKEN = 'dstrace_include_input'
 DSTRACE_EXCLUDE_INPUT_TOKEN = 'dstrace_exclude_input'
@@ -36,6 +38,7 @@ DSTRACE_CELL_TAGS = [
 ]
 
 GIT_HOOKS_REL_PATH = '.git/hooks'
+GIT_ZERO_SHA = '0' * 40
 GIT_HOOK_PRE_COMMIT_PATH = os.path.join(GIT_HOOKS_REL_PATH, 'pre-commit')
 GIT_HOOK_PRE_PUSH_PATH = os.path.join(GIT_HOOKS_REL_PATH, 'pre-commit')
 
@@ -59,6 +62,24 @@ def get_dstrace_tags(source: list) -> List[str]:
     return [t for t in line.split(' ') if t in DSTRACE_CELL_TAGS]
 
 
+def get_pushed_refs(lines) -> List[tuple]:
+    """Parses the pre-push hook input (<local ref> <local sha> <remote ref> <remote sha> per line).
+
+    Returns (branch, local sha, remote sha) tuples for the pushed branches.
+    Deletions and refs other than branches (e.g. tags) are skipped.
+    """
+    pushed = []
+    for line in lines:
+        parts = line.split()
+        if len(parts) != 4:
+            continue
+        local_ref, local_sha, _, remote_sha = parts
+        if local_sha == GIT_ZERO_SHA or not local_ref.startswith('refs/heads/'):
+            continue
+        pushed.append((local_ref[len('refs/heads/'):], local_sha, remote_sha))
+    return pushed
+
+
 def handle_input(raw_data: str, *, config) -> str:
     """Returns JSON-formatted notebook (sourced from <path>) with specific tags added.
 
@@ -68,7 +89,8 @@ def handle_input(raw_data: str, *, config) -> str:
         # add tags that can be interpreted by nbconflux
         # look here for details:
         # https://github.com/Valassis-Digital-Media/nbconflux/blob/master/nbconflux/exporter.py#L71
-        cell['metadata']['tags'] = list(set(cell['metadata'].get('tags', []) + ['noinput']))
+        # sorted to keep the processed notebook (and so its journal key) stable between runs
+        cell['metadata']['tags'] = sorted(set(cell['metadata'].get('tags', []) + ['noinput']))
         return cell
 
     def handle_cell(cell):
@@ -136,6 +158,7 @@ def handle_commit_url(raw_data: str, *, config) -> str:
     """Adds commit url to the top of the notebook.
 
     Accepts and returns raw data (utf-8 string).
+    Uses config['commit'] as the commit if given (the one being published), HEAD otherwise.
     """
 
     if config.get('no_commit_url'):
@@ -144,7 +167,7 @@ def handle_commit_url(raw_data: str, *, config) -> str:
     nb = json.loads(raw_data)
     gp = GITProxy('.')
     # TODO: use not just the last commit but the last commit where the notebook was changed.
-    url = gp.git_last_commit_url
+    url = gp.get_commit_url(config.get('commit', 'HEAD'))
     url_cell = {
         "cell_type": "markdown",
         "metadata": {
@@ -191,6 +214,14 @@ def remove_dstrace_tokens(raw_data: str, *, config) -> str:
     return json.dumps(nb)
 
 
+def preprocess(raw_data: str, processors, *, config: dict = None) -> str:
+    """Applies each <processor> from <processors> to the raw data (utf-8 string).
+    """
+    for processor in processors:
+        raw_data = processor(raw_data, config=config)
+    return raw_data
+
+
 def with_preprocessed_temp_file(processors, *, config: dict = None):
     """Applies each <processor> from <processors> to the file on the given path.
     Passes resulting processed temp file path to the decorated function.
@@ -201,9 +232,7 @@ def with_preprocessed_temp_file(processors, *, config: dict = None):
             temp_file_path = str(uuid.uuid4())
             try:
                 with open(path) as f:
-                    data = f.read()
-                for processor in processors:
-                    data = processor(data, config=config)
+                    data = preprocess(f.read(), processors, config=config)
                 with open(temp_file_path, 'w') as f:
                     f.write(data)
                 return func(temp_file_path)
@@ -215,6 +244,83 @@ def with_preprocessed_temp_file(processors, *, config: dict = None):
     return deco
 
 
+def get_journal_path() -> str:
+    """Returns the publish journal path inside of the git directory,
+    which git never tracks and which exists in bare clones as well.
+    """
+    return os.path.join(GITProxy('.').repo.git_dir, DSTRACE_JOURNAL_NAME)
+
+
+class PublishJournal:
+    """Checkpoint journal of a single Confluence page publication.
+
+    Completed steps (page update, labels, attachment uploads and finally the whole page) are written
+    to <path> right away, so that a rerun after an interrupted batch only performs the unfinished work.
+    There is one entry per page URL, holding the hash of the published notebook content:
+    any change of the notebook replaces the entry and starts the page publication from scratch,
+    as does <resume> set to false (e.g. for a forced update).
+    Entries of the pages published by a successful run are removed (see clear).
+    """
+    DONE_STEP = 'done'
+
+    def __init__(self, path: str, *, url: str, data: str, resume: bool = True):
+        self.path = path
+        self.url = url
+        self.key = hashlib.sha1(data.encode('utf-8')).hexdigest()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+        entry = self.entries.get(url, {})
+        self.steps = entry['steps'] if resume and entry.get('key') == self.key else []
+        if not resume and url in self.entries:
+            # drop the steps of an earlier run right away, they must not be resumed later on
+            del self.entries[url]
+            self.save()
+
+    def save(self):
+        # write to a temp file first so that an interruption never leaves a broken journal
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+
+    def is_done(self, step: str) -> bool:
+        return step in self.steps
+
+    def mark_done(self, step: str):
+        self.steps.append(step)
+        self.entries[self.url] = {'key': self.key, 'steps': self.steps}
+        self.save()
+
+    @property
+    def completed(self) -> bool:
+        return self.is_done(self.DONE_STEP)
+
+    def complete(self):
+        """Marks the page as fully published.
+        """
+        self.mark_done(self.DONE_STEP)
+
+    @staticmethod
+    def clear(path: str, urls):
+        """Removes the entries of the pages on <urls> once a publishing run is completed.
+        Entries of other pages are kept to be resumed later.
+        """
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            entries = json.load(f)
+        entries = {url: entry for url, entry in entries.items() if url not in urls}
+        if not entries:
+            os.remove(path)
+            return
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(temp_path, path)
+
+
 class GITProxy:
     def __init__(self, path):
         self.path = path
@@ -232,12 +338,22 @@ class GITProxy:
 
     @property
     def git_last_commit_url(self):
-        url = f'{self.git_remote_url}/commit/{self.git_last_commit_hash}'
+        return self.get_commit_url('HEAD')
+
+    def get_commit_url(self, rev):
+        url = f'{self.git_remote_url}/commit/{self.repo.commit(rev).hexsha}'
         # cast to http format in case if origin is ssh based
         if 'git@' in url:
             return url.replace(':', '/').replace('git@', 'https://')
         return url
 
+    def has_commit(self, rev):
+        try:
+            self.repo.commit(rev)
+        except (git.BadName, ValueError):
+            return False
+        return True
+
     @property
     def git_last_commit_message(self):
         return self.repo.head.commit.message
@@ -248,8 +364,52 @@ class GITProxy:
     def get_last_commit_changed_files(self):
         return self.repo.git.diff('HEAD~1..HEAD', name_only=True).split('\n')
 
-    def get_changed_files_since_last_push(self):
-        return self.repo.git.diff(f'origin/{self.repo.active_branch.name}', name_only=True).split('\n')
+    def get_changed_files(self, base, rev='HEAD'):
+        """Returns files changed between <base> and <rev> commits, all files of <rev> if <base> is None.
+
+        Compares commits only (not the working tree) and skips deleted files as those can not be published.
+        """
+        if base is None:
+            return self.repo.git.ls_tree(rev, r=True, name_only=True).split('\n')
+        return self.repo.git.diff(base, rev, name_only=True, diff_filter='d').split('\n')
+
+    def get_last_pushed_ref(self, branch):
+        """Returns the remote-tracking ref of <branch> or the local branch itself
+        if there is no remote-tracking ref (e.g. in a bare clone).
+        """
+        for ref in (f'origin/{branch}', f'refs/heads/{branch}'):
+            if self.has_commit(ref):
+                return ref
+        return None
+
+    def get_changed_files_since_last_push(self, branch=None, rev='HEAD'):
+        branch = branch or self.repo.active_branch.name
+        return self.get_changed_files(self.get_last_pushed_ref(branch), rev)
+
+    def read_blobs(self, paths, rev='HEAD'):
+        """Returns the contents (utf-8 strings) of the files on <paths> as stored in the <rev> commit.
+
+        Does not touch the working tree, so works for bare clones as well. Paths missing from the commit are left out.
+        GitPython streams all of the blobs through a single persistent `git cat-file --batch` process.
+        """
+        tree = self.repo.commit(rev).tree
+        blobs = {}
+        for path in paths:
+            try:
+                blob = tree[path]
+            except KeyError:  # never committed or deleted
+                continue
+            blobs[path] = blob.data_stream.read().decode('utf-8')
+        return blobs
+
+    def get_uncommitted_changes(self, paths):
+        """Returns those of the tracked files on <paths> that have staged or unstaged changes.
+        """
+        if self.repo.bare or not paths:
+            return []
+        status = self.repo.git.status('--porcelain', '--', *paths)
+        # '?? path' - untracked, 'XY path' - changed
+        return [line[3:] for line in status.split('\n') if line and not line.startswith('??')]
 
 
 class DSTrace:
@@ -265,12 +425,16 @@ class DSTrace:
 
         # load or create git aware config
         self.config = DSTRACE_DEFAULT_CONFIG
-        if not os.path.exists(DSTRACE_CONFIG_PATH):
-            with open(DSTRACE_CONFIG_PATH, 'w') as f:
-                f.write(yaml.dump(self.config))
-        else:
+        if os.path.exists(DSTRACE_CONFIG_PATH):
             with open(DSTRACE_CONFIG_PATH) as f:
                 self.config = yaml.load(f, Loader=yaml.SafeLoader)
+        elif git.Repo('.').bare:  # no working tree (e.g. CI clone) - use the committed config if any
+            committed = GITProxy('.').read_blobs([DSTRACE_CONFIG_PATH])
+            if DSTRACE_CONFIG_PATH in committed:
+                self.config = yaml.load(committed[DSTRACE_CONFIG_PATH], Loader=yaml.SafeLoader)
+        else:
+            with open(DSTRACE_CONFIG_PATH, 'w') as f:
+                f.write(yaml.dump(self.config))
 
         # merge local config into VCS-aware config
         self.config.update(local_config)
@@ -324,41 +488,68 @@ class DSTrace:
         )
 
     @staticmethod
-    def publish_to_confluence(*, source: str, target: str, username: str, token: str):
+    def publish_to_confluence(*, source: str, data: str, target: str, username: str, token: str,
+                              enable_style: bool = True, style_url: str = None, journal: PublishJournal = None):
         _, _ = notebook_to_page(
             source,
             target,
             username=username,
             password=token,
+            enable_style=enable_style,
+            style_url=style_url,
+            notebook_data=data,
+            journal=journal,
         )
 
-    def get_unstaged_changes(self):
+    def get_pages_to_update(self, *, branch=None, rev='HEAD', remote_sha=None):
+        """Returns pages of <branch> (the active one by default) with notebooks changed in <rev>
+        since <remote_sha> (the pushed state known to the pre-push hook) or since the last push.
+        """
         gp = GITProxy('.')
-        git_direct_CLI = gp.repo.git
-        status = git_direct_CLI.status('--porcelain')
-        changes = status.split('\n')
-        unstaged_changes_raw = [file for file in changes if file.startswith(' M')]
-        #  'M path/filename' - staged modified
-        #  ' M path/filename' - unstaged modified
-
-        unstaged_filenames = [file.split('M')[1].lstrip() for file in unstaged_changes_raw]
-        return unstaged_filenames
+        branch = branch or gp.repo.active_branch.name
 
-    def get_pages_to_update(self):
-        gp = GITProxy('.')
-        unstaged = self.get_unstaged_changes()
+        # notebooks are published as committed so working tree changes do not matter here
+        if remote_sha == GIT_ZERO_SHA:  # a new remote branch
+            changed = gp.get_changed_files(None, rev)
+        elif remote_sha is not None and gp.has_commit(remote_sha):
+            changed = gp.get_changed_files(remote_sha, rev)
+        else:
+            changed = gp.get_changed_files_since_last_push(branch, rev)
 
         return {
             notebook: confluence_config for notebook, confluence_config in self.confluence_pages.items()
             if
-            notebook in gp.get_changed_files_since_last_push()
-            and
-            notebook not in unstaged
+            notebook in changed
             and
-            confluence_config['branch'] == gp.repo.active_branch.name
+            confluence_config['branch'] == branch
         }
 
-    def batch_publish_to_confluence(self, pages):
+    def get_confluence_credentials(self, *, interactive=True):
+        """Returns Confluence API username and token from the config, prompting for the missing ones
+        unless <interactive> is false (e.g. git hook stdin is already consumed).
+        """
+        username = self.config.get('confluence_api_username')
+        token = self.config.get('confluence_api_token')
+        if not interactive and not (username and token):
+            raise ValueError(
+                'Confluence API credentials are required to update Confluence pages from the git hook.\n'
+                f'Set confluence_api_username and confluence_api_token in {DSTRACE_LOCAL_CONFIG_PATH} '
+                'and rerun the command.\n'
+            )
+        if not username:
+            username = input('Enter Confluence API username: ')
+        if not token:
+            token = input('Enter Confluence API token: ')
+        return username, token
+
+    def batch_publish_to_confluence(self, pages, rev='HEAD', resume=True, interactive=True):
+        """Publishes notebooks of <pages> as stored in <rev> to Confluence.
+
+        Resumes the pages interrupted in an earlier run unless <resume> is false.
+        Fails on missing credentials instead of prompting for them unless <interactive> is true.
+        Returns URLs of the published pages.
+        """
+        published = []
         if pages:
             count = len(pages)
             noun = 'page' if count == 1 else 'pages'
@@ -367,22 +558,17 @@ class DSTrace:
                 sys.stdout.write(f'{i + 1}. {notebook} >> {confluence_config}\n')
             sys.stdout.write('\n')
 
-            username = self.config.get('confluence_api_username')
-            if not username:
-                username = input('Enter Confluence API username: ')
-            token = self.config.get('confluence_api_token')
-            if not token:
-                token = input('Enter Confluence API token: ')
+            username, token = self.get_confluence_credentials(interactive=interactive)
 
-            for notebook, confluence_config in pages.items():
+            journal_path = get_journal_path()
 
-                def do_publish(nb_path):
-                    self.publish_to_confluence(
-                        source=nb_path,
-                        target=confluence_config['confluence_url'],
-                        username=username,
-                        token=token,
-                    )
+            # read the notebooks from the published commit rather than from the working tree
+            notebooks = GITProxy('.').read_blobs(list(pages), rev)
+
+            for notebook, confluence_config in pages.items():
+                if notebook not in notebooks:
+                    sys.stdout.write(f'Skipping {notebook}: not found in commit {rev}.\n')
+                    continue
 
                 processors = [
                     handle_input,
@@ -390,10 +576,33 @@ class DSTrace:
                     handle_commit_url,
                     remove_dstrace_tokens,
                 ]
-                publish = with_preprocessed_temp_file(processors, config=confluence_config)(do_publish)
-                publish(notebook)
+                data = preprocess(notebooks[notebook], processors, config=dict(confluence_config, commit=rev))
+
+                # steps completed by an interrupted run for the very same content are not repeated
+                journal = PublishJournal(journal_path, url=confluence_config['confluence_url'], data=data,
+                                         resume=resume)
+                if journal.completed:
+                    sys.stdout.write(f'Skipping {notebook}: already published by an interrupted run.\n')
+                    published.append(confluence_config['confluence_url'])
+                    continue
+                if journal.steps:
+                    sys.stdout.write(f'Resuming {notebook}: skipping {len(journal.steps)} completed steps.\n')
+
+                self.publish_to_confluence(
+                    source=notebook,
+                    data=data,
+                    target=confluence_config['confluence_url'],
+                    username=username,
+                    token=token,
+                    enable_style=not confluence_config.get('no_style'),  # [CONFIG]
+                    style_url=confluence_config.get('style_url'),  # [CONFIG]
+                    journal=journal,
+                )
+                journal.complete()
+                published.append(confluence_config['confluence_url'])
         else:
             sys.stdout.write('No Confluence pages to update.\n')
+        return published
 
 
 class CLI:
@@ -459,9 +668,25 @@ class CLI:
     def pre_push():
         sys.stdout.write('\nDSTrace pre-push started.\n')
         dstrace = DSTrace()
-        dstrace.batch_publish_to_confluence(
-            dstrace.get_pages_to_update(),
-        )
+        # git passes the pushed refs to the hook via stdin, publish exactly the commits being pushed
+        # stdin is read to the end then, so credentials can not be prompted for anymore
+        interactive = sys.stdin.isatty()
+        pushed = get_pushed_refs([] if interactive else sys.stdin)
+        published = []
+        if pushed:
+            for branch, local_sha, remote_sha in pushed:
+                published += dstrace.batch_publish_to_confluence(
+                    dstrace.get_pages_to_update(branch=branch, rev=local_sha, remote_sha=remote_sha),
+                    rev=local_sha,
+                    interactive=interactive,
+                )
+        else:
+            published = dstrace.batch_publish_to_confluence(
+                dstrace.get_pages_to_update(),
+                interactive=interactive,
+            )
+        # the published pages are done, nothing to resume for them anymore
+        PublishJournal.clear(get_journal_path(), published)
         sys.stdout.write('\nDSTrace pre-push completed.\n\n')
 
     @staticmethod
@@ -492,7 +717,11 @@ class CLI:
             os.system(f'jupyter nbconvert --to script {abs_path} --output {abs_path} && git add {abs_path}.py')
 
     @staticmethod
-    def force_update_confluence_pages(path_glob_mask=None):
+    def force_update_confluence_pages(path_glob_mask=None, resume=False):
+        """Publishes notebooks of the active branch (matching <path_glob_mask> if given) to Confluence.
+
+        Forced update republishes the pages from scratch, pass --resume to continue an interrupted run instead.
+        """
         sys.stdout.write('Started on-demand Confluence update\n\n')
 
         gp = GITProxy('.')
@@ -517,7 +746,13 @@ class CLI:
                 if nb in target_paths
             }
 
-        dstrace.batch_publish_to_confluence(pages)
+        # notebooks are published as committed, make it visible that local edits are not
+        for nb in gp.get_uncommitted_changes(list(pages)):
+            sys.stdout.write(f'Warning: {nb} has uncommitted changes, publishing its last committed version.\n')
+
+        published = dstrace.batch_publish_to_confluence(pages, resume=resume)
+        # the published pages are done, resume state of the other pages is kept
+        PublishJournal.clear(get_journal_path(), published)
 
 
 def main():
@@ -25,7 +25,7 @@ setup(
     author_email='alexander.tatchin@gmail.com',
     description='Data science workflow automation tool.',
     long_description=__doc__,
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     include_package_data=True,
     zip_safe=False,
     platforms='any',
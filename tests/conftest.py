@@ -0,0 +1,62 @@
+import json
+
+import git
+import pytest
+import yaml
+
+
+ACTOR = git.Actor('DSTrace', 'dstrace@example.com')
+PAGE_URL = 'http://confluence.localhost/pages/viewpage.action?pageId=12345'
+
+
+def make_notebook(*sources) -> str:
+    cells = [
+        {'cell_type': 'code', 'execution_count': 1, 'metadata': {}, 'outputs': [], 'source': source}
+        for source in sources
+    ]
+    return json.dumps({'cells': cells, 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 4})
+
+
+def commit_files(repo, files: dict, message='commit'):
+    for path, content in files.items():
+        with open(f'{repo.working_dir}/{path}', 'w') as f:
+            f.write(content)
+    repo.index.add(list(files))
+    return repo.index.commit(message, author=ACTOR, committer=ACTOR)
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """Bare repository with a single commit on master holding the DSTrace config and a notebook.
+    """
+    work = git.Repo.init(tmp_path / 'work')
+    commit_files(work, {
+        '.dstrace': yaml.dump({
+            'confluence_pages': {
+                'nb.ipynb': {'branch': 'master', 'confluence_url': PAGE_URL},
+            },
+        }),
+        'nb.ipynb': make_notebook(['print(1)']),
+    })
+    work.git.branch('-M', 'master')
+    path = tmp_path / 'remote.git'
+    work.clone(path, bare=True)
+    return path
+
+
+@pytest.fixture
+def clone(remote, tmp_path, monkeypatch):
+    """Regular clone of the remote repository used as the current directory.
+    """
+    repo = git.Repo.clone_from(remote, tmp_path / 'clone')
+    monkeypatch.chdir(repo.working_dir)
+    return repo
+
+
+@pytest.fixture
+def bare_clone(remote, tmp_path, monkeypatch):
+    """Bare clone of the remote repository (as in CI) used as the current directory.
+    """
+    repo = git.Repo.clone_from(remote, tmp_path / 'bare.git', bare=True)
+    monkeypatch.chdir(repo.git_dir)
+    return repo
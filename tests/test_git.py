@@ -0,0 +1,109 @@
+import io
+import json
+
+import git
+import pytest
+
+from dstrace.dstrace import GIT_ZERO_SHA, CLI, DSTrace, GITProxy, get_pushed_refs, handle_commit_url
+
+from conftest import commit_files, make_notebook
+
+
+def test_get_pushed_refs():
+    sha, remote_sha = 'a' * 40, 'b' * 40
+    lines = [
+        f'refs/heads/master {sha} refs/heads/master {remote_sha}\n',
+        f'refs/heads/feature {sha} refs/heads/feature {GIT_ZERO_SHA}\n',
+        f'(delete) {GIT_ZERO_SHA} refs/heads/old {remote_sha}\n',
+        f'refs/tags/v1 {sha} refs/tags/v1 {GIT_ZERO_SHA}\n',
+        '\n',
+    ]
+    assert get_pushed_refs(lines) == [
+        ('master', sha, remote_sha),
+        ('feature', sha, GIT_ZERO_SHA),
+    ]
+
+
+def test_pages_to_update_uses_pushed_range(clone):
+    pushed = clone.head.commit.hexsha
+    local = commit_files(clone, {'nb.ipynb': make_notebook(['print(2)'])}).hexsha
+
+    dstrace = DSTrace()
+    assert list(dstrace.get_pages_to_update(branch='master', rev=local, remote_sha=pushed)) == ['nb.ipynb']
+    assert dstrace.get_pages_to_update(branch='master', rev=local, remote_sha=local) == {}
+    # a new remote branch publishes everything it holds
+    assert list(dstrace.get_pages_to_update(branch='master', rev=local, remote_sha=GIT_ZERO_SHA)) == ['nb.ipynb']
+    # pages configured for other branches are not published
+    assert dstrace.get_pages_to_update(branch='feature', rev=local, remote_sha=pushed) == {}
+
+
+def test_pages_to_update_falls_back_to_remote_tracking_ref(clone):
+    commit_files(clone, {'nb.ipynb': make_notebook(['print(2)'])})
+    # an unknown remote sha (e.g. not fetched yet) is replaced by origin/<branch>
+    assert list(DSTrace().get_pages_to_update(remote_sha='c' * 40)) == ['nb.ipynb']
+
+
+def test_bare_clone_falls_back_to_local_branch(bare_clone):
+    gp = GITProxy('.')
+    assert gp.get_last_pushed_ref('master') == 'refs/heads/master'
+    assert DSTrace().get_pages_to_update() == {}
+
+
+def test_handle_commit_url_uses_published_commit(clone):
+    pushed = clone.head.commit.hexsha
+    commit_files(clone, {'nb.ipynb': make_notebook(['print(2)'])})
+
+    nb = json.loads(handle_commit_url(make_notebook(['print(1)']), config={'commit': pushed}))
+    assert pushed in nb['cells'][0]['source'][0]
+
+
+def test_read_blobs_skips_missing_paths(clone):
+    blobs = GITProxy('.').read_blobs(['nb.ipynb', 'new.ipynb'])
+    assert list(blobs) == ['nb.ipynb']
+    assert json.loads(blobs['nb.ipynb'])['cells'][0]['source'] == ['print(1)']
+
+
+def test_get_uncommitted_changes(clone):
+    with open('nb.ipynb', 'w') as f:
+        f.write(make_notebook(['print(2)']))
+    with open('new.ipynb', 'w') as f:
+        f.write(make_notebook(['print(3)']))
+    assert GITProxy('.').get_uncommitted_changes(['nb.ipynb', 'new.ipynb']) == ['nb.ipynb']
+
+
+def test_batch_publish_skips_notebooks_missing_from_commit(clone, monkeypatch, capsys):
+    published = []
+    monkeypatch.setattr(DSTrace, 'publish_to_confluence', staticmethod(lambda **kw: published.append(kw['source'])))
+
+    dstrace = DSTrace()
+    dstrace.config.update(confluence_api_username='user', confluence_api_token='token')
+    config = {'branch': 'master', 'confluence_url': 'http://confluence.localhost/x', 'no_commit_url': True}
+    dstrace.batch_publish_to_confluence({'new.ipynb': config, 'nb.ipynb': config})
+
+    assert published == ['nb.ipynb']
+    assert 'Skipping new.ipynb: not found in commit HEAD.' in capsys.readouterr().out
+
+
+def test_pre_push_requires_stored_credentials(clone, monkeypatch):
+    published = []
+    monkeypatch.setattr(DSTrace, 'publish_to_confluence', staticmethod(lambda **kw: published.append(kw['source'])))
+    pushed = clone.head.commit.hexsha
+    local = commit_files(clone, {'nb.ipynb': make_notebook(['print(2)'])}).hexsha
+    # the hook stdin is consumed by the pushed refs, credentials can not be prompted for
+    monkeypatch.setattr('sys.stdin', io.StringIO(f'refs/heads/master {local} refs/heads/master {pushed}\n'))
+
+    with pytest.raises(ValueError, match=r'\.dstracelocal'):
+        CLI.pre_push()
+    assert published == []
+
+
+def test_bare_clone_reads_committed_config(bare_clone):
+    assert list(DSTrace().confluence_pages) == ['nb.ipynb']
+
+
+def test_bare_clone_without_committed_config(tmp_path, monkeypatch):
+    work = git.Repo.init(tmp_path / 'work')
+    commit_files(work, {'nb.ipynb': make_notebook(['print(1)'])})
+    bare = work.clone(tmp_path / 'bare.git', bare=True)
+    monkeypatch.chdir(bare.git_dir)
+    assert DSTrace().confluence_pages == {}
@@ -0,0 +1,195 @@
+import json
+import os
+import subprocess
+import sys
+from unittest import mock
+
+import pytest
+
+from dstrace.dstrace import DSTrace, PublishJournal, get_journal_path, handle_input
+from dstrace.vendor.nbconflux.nbconflux.api import notebook_to_page
+from dstrace.vendor.nbconflux.nbconflux.exporter import ConfluenceExporter
+
+from conftest import PAGE_URL, commit_files, make_notebook
+
+
+class StubJournal:
+    def __init__(self, *steps):
+        self.steps = list(steps)
+
+    def is_done(self, step):
+        return step in self.steps
+
+    def mark_done(self, step):
+        self.steps.append(step)
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / 'dstrace-journal')
+
+
+def test_journal_resumes_steps(journal_path):
+    journal = PublishJournal(journal_path, url=PAGE_URL, data='nb')
+    journal.mark_done('page')
+    journal.mark_done('attachment:a.png')
+
+    journal = PublishJournal(journal_path, url=PAGE_URL, data='nb')
+    assert journal.steps == ['page', 'attachment:a.png']
+    assert journal.is_done('page') and not journal.is_done('label:nbconflux')
+    assert not journal.completed
+
+
+def test_journal_keeps_completed_pages(journal_path):
+    PublishJournal(journal_path, url=PAGE_URL, data='nb').complete()
+    assert PublishJournal(journal_path, url=PAGE_URL, data='nb').completed
+
+    PublishJournal.clear(journal_path, [PAGE_URL])
+    assert not os.path.exists(journal_path)
+    assert PublishJournal(journal_path, url=PAGE_URL, data='nb').steps == []
+
+
+def test_journal_clears_published_pages_only(journal_path):
+    PublishJournal(journal_path, url=PAGE_URL, data='nb').complete()
+    PublishJournal(journal_path, url=PAGE_URL + '1', data='other').mark_done('page')
+
+    PublishJournal.clear(journal_path, [PAGE_URL])
+    assert PublishJournal(journal_path, url=PAGE_URL, data='nb').steps == []
+    assert PublishJournal(journal_path, url=PAGE_URL + '1', data='other').steps == ['page']
+
+
+def test_journal_does_not_resume_when_disabled(journal_path):
+    PublishJournal(journal_path, url=PAGE_URL, data='nb').complete()
+
+    assert PublishJournal(journal_path, url=PAGE_URL, data='nb', resume=False).steps == []
+    # the stale entry is gone, an interrupted forced run resumes its own steps only
+    assert not PublishJournal(journal_path, url=PAGE_URL, data='nb').completed
+
+
+def test_journal_replaces_entry_of_changed_content(journal_path):
+    PublishJournal(journal_path, url=PAGE_URL, data='old').mark_done('page')
+
+    journal = PublishJournal(journal_path, url=PAGE_URL, data='new')
+    assert journal.steps == []
+    journal.mark_done('page')
+
+    with open(journal_path) as f:
+        entries = json.load(f)
+    assert list(entries) == [PAGE_URL]
+    assert entries[PAGE_URL]['key'] == journal.key
+
+
+def test_journal_save_is_atomic(journal_path):
+    PublishJournal(journal_path, url=PAGE_URL, data='nb').mark_done('page')
+
+    journal = PublishJournal(journal_path, url=PAGE_URL, data='nb')
+    with mock.patch('dstrace.dstrace.json.dump', side_effect=KeyboardInterrupt):
+        with pytest.raises(KeyboardInterrupt):
+            journal.mark_done('label:nbconflux')
+
+    assert PublishJournal(journal_path, url=PAGE_URL, data='nb').steps == ['page']
+
+
+def test_journal_key_is_stable_across_runs():
+    # handle_input output must not depend on the hash seed of the process, otherwise a rerun never resumes
+    raw_data = make_notebook(['print(1)'])
+    nb = json.loads(raw_data)
+    nb['cells'][0]['metadata']['tags'] = ['b', 'a', 'c']
+    script = (
+        'import sys; from dstrace.dstrace import handle_input, PublishJournal; '
+        'data = handle_input(sys.stdin.read(), config={}); '
+        'print(PublishJournal("/nonexistent", url="url", data=data).key)'
+    )
+    keys = {
+        subprocess.run(
+            [sys.executable, '-c', script],
+            input=json.dumps(nb), capture_output=True, text=True, check=True,
+            env=dict(os.environ, PYTHONHASHSEED=str(seed)),
+        ).stdout
+        for seed in range(5)
+    }
+    assert len(keys) == 1
+    assert json.loads(handle_input(json.dumps(nb), config={}))['cells'][0]['metadata']['tags'] == [
+        'a', 'b', 'c', 'noinput',
+    ]
+
+
+def test_exporter_skips_and_records_steps():
+    png_output = {
+        'output_type': 'display_data',
+        'metadata': {},
+        'data': {'image/png': 'iVBORw0KGgo=', 'text/plain': ['<Figure>']},
+    }
+    nb = json.loads(make_notebook(['plot()']))
+    nb['cells'][0]['outputs'] = [png_output]
+    journal = StubJournal('page', 'label:nbconflux')
+
+    attachments = mock.Mock()
+    attachments.json.return_value = {'results': []}
+    with mock.patch('dstrace.vendor.nbconflux.nbconflux.preprocessor.requests.get', return_value=attachments), \
+            mock.patch.object(ConfluenceExporter, 'update_page') as update_page, \
+            mock.patch.object(ConfluenceExporter, 'add_label') as add_label, \
+            mock.patch.object(ConfluenceExporter, 'add_or_update_attachment') as add_or_update_attachment:
+        notebook_to_page('nb.ipynb', PAGE_URL, username='user', password='token', extra_labels=['extra'],
+                         notebook_data=json.dumps(nb), journal=journal)
+
+    update_page.assert_not_called()
+    add_label.assert_called_once_with(12345, 'extra')
+    assert [c.args[0] for c in add_or_update_attachment.call_args_list] == ['output_0_0.png', 'nb.ipynb']
+    assert journal.steps == [
+        'page', 'label:nbconflux', 'label:extra', 'attachment:output_0_0.png', 'attachment:nb.ipynb',
+    ]
+
+
+def test_batch_resumes_after_interruption(clone, monkeypatch, capsys):
+    failing = {'other.ipynb'}
+    published = []
+
+    def publish(*, source, journal, **kw):
+        if source in failing:
+            raise ConnectionError
+        journal.mark_done('page')
+        published.append(source)
+
+    monkeypatch.setattr(DSTrace, 'publish_to_confluence', staticmethod(publish))
+    dstrace = DSTrace()
+    dstrace.config.update(confluence_api_username='user', confluence_api_token='token')
+    pages = {
+        'nb.ipynb': {'confluence_url': PAGE_URL, 'no_commit_url': True},
+        'other.ipynb': {'confluence_url': PAGE_URL + '1', 'no_commit_url': True},
+    }
+    commit_files(clone, {'other.ipynb': make_notebook(['print(2)'])})
+
+    with pytest.raises(ConnectionError):
+        dstrace.batch_publish_to_confluence(pages)
+    failing.clear()
+    dstrace.batch_publish_to_confluence(pages)
+
+    assert published == ['nb.ipynb', 'other.ipynb']
+    assert 'Skipping nb.ipynb: already published by an interrupted run.' in capsys.readouterr().out
+
+
+def test_batch_without_resume_republishes_pages(clone, monkeypatch):
+    published = []
+
+    def publish(*, source, journal, **kw):
+        journal.mark_done('page')
+        published.append(source)
+
+    monkeypatch.setattr(DSTrace, 'publish_to_confluence', staticmethod(publish))
+    dstrace = DSTrace()
+    dstrace.config.update(confluence_api_username='user', confluence_api_token='token')
+    pages = {'nb.ipynb': {'confluence_url': PAGE_URL, 'no_commit_url': True}}
+
+    assert dstrace.batch_publish_to_confluence(pages) == [PAGE_URL]
+    assert dstrace.batch_publish_to_confluence(pages) == [PAGE_URL]  # skipped, but counts as published
+    assert dstrace.batch_publish_to_confluence(pages, resume=False) == [PAGE_URL]
+    assert published == ['nb.ipynb', 'nb.ipynb']
+
+
+def test_journal_is_kept_in_git_dir(clone):
+    assert get_journal_path() == os.path.join(clone.git_dir, 'dstrace-journal')
+
+
+def test_journal_is_kept_in_bare_clone_git_dir(bare_clone):
+    assert get_journal_path() == os.path.join(bare_clone.git_dir, 'dstrace-journal')
@@ -0,0 +1,59 @@
+from unittest import mock
+
+import pytest
+
+from dstrace.dstrace import DSTrace
+from dstrace.vendor.nbconflux.nbconflux.api import notebook_to_page
+from dstrace.vendor.nbconflux.nbconflux.exporter import DEFAULT_STYLE_URL, ConfluenceExporter
+
+from conftest import PAGE_URL, make_notebook
+
+
+def render(**kwargs) -> str:
+    """Returns the page body published for a small notebook with the given notebook_to_page options.
+    """
+    attachments = mock.Mock()
+    attachments.json.return_value = {'results': []}
+    with mock.patch('dstrace.vendor.nbconflux.nbconflux.preprocessor.requests.get', return_value=attachments), \
+            mock.patch.object(ConfluenceExporter, 'update_page') as update_page, \
+            mock.patch.object(ConfluenceExporter, 'add_label'), \
+            mock.patch.object(ConfluenceExporter, 'add_or_update_attachment'):
+        notebook_to_page('nb.ipynb', PAGE_URL, username='user', password='token',
+                         notebook_data=make_notebook(['print(1)']), **kwargs)
+    (_, body), _ = update_page.call_args
+    return body
+
+
+def test_default_style():
+    html = render()
+    assert f'<ac:parameter ac:name="import">{DEFAULT_STYLE_URL}</ac:parameter>' in html
+
+
+def test_shared_style_url():
+    html = render(style_url='https://x/notebook.css')
+    assert '<ac:parameter ac:name="import">https://x/notebook.css</ac:parameter>' in html
+    assert DEFAULT_STYLE_URL not in html
+
+
+def test_style_disabled():
+    html = render(enable_style=False, style_url='https://x/notebook.css')
+    assert 'ac:name="import"' not in html
+    assert 'https://x/notebook.css' not in html
+
+
+@pytest.mark.parametrize('page_config, expected', [
+    ({}, {'enable_style': True, 'style_url': None}),
+    ({'no_style': True}, {'enable_style': False, 'style_url': None}),
+    ({'style_url': 'https://x/notebook.css'}, {'enable_style': True, 'style_url': 'https://x/notebook.css'}),
+])
+def test_batch_publish_passes_style_config(clone, monkeypatch, page_config, expected):
+    published = []
+    monkeypatch.setattr(DSTrace, 'publish_to_confluence', staticmethod(lambda **kw: published.append(kw)))
+
+    dstrace = DSTrace()
+    dstrace.config.update(confluence_api_username='user', confluence_api_token='token')
+    dstrace.batch_publish_to_confluence({
+        'nb.ipynb': dict(page_config, branch='master', confluence_url=PAGE_URL, no_commit_url=True),
+    })
+
+    assert {key: published[0][key] for key in expected} == expected